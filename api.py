@@ -4,28 +4,29 @@ FastAPI сервер для системы проверки фактологич
 
 from fastapi import FastAPI, UploadFile, File, HTTPException, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 import os
+import json
+import hashlib
 import shutil
 import tempfile
 from pathlib import Path
 import logging
-import nest_asyncio
-
-# Разрешаем вложенные event loops для совместимости с LlamaIndex
-nest_asyncio.apply()
+import time
+import asyncio
+import aiofiles
+from cachetools import LRUCache
 
 # Импорты из существующей системы
-from src.graph_rag import custom_embedder, custom_llm
+from src.graph_rag import emb_model, custom_embedder, custom_llm, CachedVectorContextRetriever, create_vector_index, count_triplets, get_kg_extractors
 from src.chunk_getter import Data
 from llama_index.core import PropertyGraphIndex, SimpleDirectoryReader
-from src.fact_checker import checker
-from llama_index.core.postprocessor import LLMRerank
-from llama_index.core.prompts import PromptTemplate
+from src.fact_checker import checker, llm_service, FactConsistencyChecker
+from llama_index.core.postprocessor import SentenceTransformerRerank
 from llama_index.graph_stores.neo4j import Neo4jPGStore
-from llama_index.core.retrievers import VectorContextRetriever, LLMSynonymRetriever
+from llama_index.core.retrievers import LLMSynonymRetriever
 from llama_index.core import QueryBundle
 import tokens
 
@@ -49,22 +50,52 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Максимальное число закэшированных пар ретриверов (по одной на vector_top_k)
+RETRIEVERS_CACHE_SIZE = 8
+
 # Глобальное состояние
 class AppState:
     def __init__(self):
         self.graph_index = None
         self.graph_store = None
         self.temp_dir = None
+        self.triplets_count = None
+        self.triplets_count_time = 0.0
+        # Кэши переиспользуемых объектов, чтобы не собирать их на каждый запрос
+        # Ретриверы держат собственный семантический кэш, поэтому хранятся только недавние
+        self.retrievers = LRUCache(maxsize=RETRIEVERS_CACHE_SIZE)
+        self.rerankers = {}
+        self.checkers = {checker.language: checker}
+        # Кэш готовых ответов проверки: ключ -> (время, ответ)
+        self.responses = {}
+        # Поколение индекса: увеличивается при каждой перестройке и очистке индекса,
+        # чтобы результаты, посчитанные на старом индексе, не попадали в кэши
+        self.index_generation = 0
+        # Блокировка построения и очистки индекса
+        self.index_lock = asyncio.Lock()
+        # Фоновая задача прогрева моделей
+        self.warmup_task = None
         
 app_state = AppState()
 
+# Время жизни закэшированного количества триплетов (в секундах)
+TRIPLETS_COUNT_TTL = 30
+
+# Время жизни и максимальный размер кэша ответов проверки
+RESPONSE_CACHE_TTL = 3600
+RESPONSE_CACHE_SIZE = 1024
+
+# Размер блока при сохранении загруженных файлов (1 МиБ)
+UPLOAD_CHUNK_SIZE = 1 << 20
+
 # Pydantic модели для запросов/ответов
 class CheckContradictionsRequest(BaseModel):
     text: str
-    vector_top_k: int = 30
-    reranker_top_n: int = 5
+    # Границы совпадают с полями ввода во frontend; значения являются ключами кэшей ретриверов и реранкеров
+    vector_top_k: int = Field(30, ge=1, le=100)
+    reranker_top_n: int = Field(5, ge=1, le=20)
     with_reranker: bool = True
-    language: str = "en"  # Язык системного промпта: "en" или "ru"
+    language: Literal["en", "ru"] = "en"  # Язык системного промпта
 
 class StatusResponse(BaseModel):
     database_connected: bool
@@ -101,69 +132,178 @@ def get_graph_store():
         raise HTTPException(status_code=500, detail=f"Не удалось подключиться к Neo4j: {str(e)}")
 
 
-def get_retrieved_nodes(index, query_str, vector_top_k=10, reranker_top_n=3, with_reranker=False):
-    """Получение релевантных узлов из графа (копия из main.py)"""
-    query_bundle = QueryBundle(query_str)
+def sendfile_copy(in_fd: int, file_path: str):
+    """Копирование файла средствами ядра (os.sendfile) без буферов Python"""
+    size = os.fstat(in_fd).st_size
+    with open(file_path, "wb") as out:
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(out.fileno(), in_fd, offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
 
-    syn = LLMSynonymRetriever(
-        graph_store=index.property_graph_store,
-        llm=custom_llm,
-        include_text=True,
-        max_keywords=8,
-        path_depth=5
-    )
 
-    vec = VectorContextRetriever(
-        graph_store=index.property_graph_store,
-        vector_store=index.vector_store,
-        embed_model=custom_embedder,
-        include_text=True,
-        similarity_top_k=vector_top_k,
-        path_depth=5
-    )
+def upload_paths(files: List[UploadFile], directory: str) -> List[str]:
+    """
+    Пути для сохранения загруженных файлов внутри директории.
+    От имени файла остается только последний компонент (клиент не может записать файл
+    вне директории), а одинаковые имена получают суффикс, чтобы параллельная запись
+    не шла в один и тот же файл.
+    """
+    paths = []
+    used = set()
+    for file in files:
+        name = os.path.basename((file.filename or "").replace("\\", "/"))
+        if name in ("", ".", ".."):
+            name = "upload"
+        stem, ext = os.path.splitext(name)
+        candidate, index = name, 1
+        while candidate in used:
+            candidate = f"{stem}_{index}{ext}"
+            index += 1
+        used.add(candidate)
+        paths.append(os.path.join(directory, candidate))
+    return paths
+
+
+async def save_upload(file: UploadFile, file_path: str):
+    """Асинхронное сохранение загруженного файла по указанному пути"""
+    # Крупные загрузки starlette уже держит во временном файле на диске:
+    # копируем их через sendfile, не прогоняя данные через Python
+    if hasattr(os, "sendfile") and getattr(file.file, "_rolled", False):
+        try:
+            await asyncio.to_thread(sendfile_copy, file.file.fileno(), file_path)
+            logger.info(f"Сохранен файл: {file.filename}")
+            return
+        except OSError as e:
+            logger.warning(f"sendfile недоступен, копируем файл {file.filename} по частям: {str(e)}")
+    
+    async with aiofiles.open(file_path, "wb") as f:
+        # Копируем частями, чтобы не держать весь файл в памяти
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await f.write(chunk)
+    logger.info(f"Сохранен файл: {file.filename}")
 
-    retriever = index.as_retriever(sub_retrievers=[syn, vec], include_text=True)
 
-    retrieved_nodes = retriever.retrieve(query_bundle)
-    
-    if with_reranker:
-        prompt_str = (
-            "A list of documents is shown below. Each document has a number next to it along with a summary of the document. A question is also provided. \n"
-            "Respond with the numbers of the documents you should consult to answer the question, in order of relevance, as well as the relevance score. The relevance score is a number from 1-10 based on how relevant you think the document is to the question.\n"
-            "Prioritize documents based on their relevance to the question, regardless of whether they support or contradict the query. Both confirming and contradicting facts are considered equally relevant if they provide significant information, context, or arguments related to the question.\n"
-            "Assign relevance scores in a balanced way to fairly represent differing viewpoints or data, ensuring that conflicting evidence is not overshadowed by other documents.\n"
-            "Always include at least one document in the response, selecting the most relevant documents even if the relevance is low.\n"
-            "Do not include documents that are irrelevant to the question.\n"
-            "Example format: \n"
-            "Document 1:\n<summary of document 1>\n\n"
-            "Document 2:\n<summary of document 2>\n\n"
-            "...\n\n"
-            "Document 10:\n<summary of document 10>\n\n"
-            "Question: <question>\n"
-            "Answer:\n"
-            "Doc: 9, Relevance: 7\n"
-            "Doc: 3, Relevance: 4\n"
-            "Doc: 7, Relevance: 3\n\n"
-            "Let's try this now: \n\n"
-            "{context_str}\n"
-            "Question: {query_str}\n"
-            "Answer:\n"
-        )
+# Локальная cross-encoder модель для реранкинга
+RERANKER_MODEL = "BAAI/bge-reranker-v2-m3"
 
-        custom_choice_template = PromptTemplate(template=prompt_str)
 
-        reranker = LLMRerank(
+def get_retrievers(index, vector_top_k):
+    """Получение пары ретриверов (syn, vec) для индекса из кэша (создается один раз на vector_top_k)"""
+    if vector_top_k not in app_state.retrievers:
+        syn = LLMSynonymRetriever(
+            graph_store=index.property_graph_store,
             llm=custom_llm,
-            choice_batch_size=5,
-            top_n=reranker_top_n,
-            choice_select_prompt=custom_choice_template
+            include_text=True,
+            max_keywords=8,
+            path_depth=5
+        )
+
+        vec = CachedVectorContextRetriever(
+            graph_store=index.property_graph_store,
+            vector_store=index.vector_store,
+            embed_model=custom_embedder,
+            include_text=True,
+            similarity_top_k=vector_top_k,
+            path_depth=5
         )
 
-        retrieved_nodes = reranker.postprocess_nodes(retrieved_nodes, query_bundle)
+        app_state.retrievers[vector_top_k] = (syn, vec)
+    return app_state.retrievers[vector_top_k]
+
+
+def get_reranker(reranker_top_n):
+    """Получение реранкера из кэша (модель загружается один раз и общая для всех top_n)"""
+    if reranker_top_n not in app_state.rerankers:
+        if not app_state.rerankers:
+            reranker = SentenceTransformerRerank(model=RERANKER_MODEL, top_n=reranker_top_n)
+        else:
+            base = next(iter(app_state.rerankers.values()))
+            reranker = base.model_copy(update={"top_n": reranker_top_n})
+        app_state.rerankers[reranker_top_n] = reranker
+    return app_state.rerankers[reranker_top_n]
+
+
+def get_checker(language):
+    """Получение checker'а для языка из кэша"""
+    if language not in app_state.checkers:
+        app_state.checkers[language] = FactConsistencyChecker(llm_service=llm_service, language=language)
+    return app_state.checkers[language]
+
+
+def merge_nodes(*node_lists):
+    """Объединение результатов ретриверов без дублей (сохраняется узел с лучшим score)"""
+    merged = {}
+    for nodes in node_lists:
+        for node in nodes:
+            node_id = node.node.node_id
+            best = merged.get(node_id)
+            if best is None or (node.score or 0) > (best.score or 0):
+                merged[node_id] = node
+    return list(merged.values())
+
+
+async def get_retrieved_nodes(index, query_str, vector_top_k=10, reranker_top_n=3, with_reranker=False):
+    """Получение релевантных узлов из графа (копия из main.py)"""
+    query_bundle = QueryBundle(query_str)
+
+    # Ретриверы независимы, поэтому запускаем их параллельно
+    syn, vec = get_retrievers(index, vector_top_k)
+    syn_nodes, vec_nodes = await asyncio.gather(
+        syn.aretrieve(query_bundle),
+        vec.aretrieve(query_bundle)
+    )
+    retrieved_nodes = merge_nodes(syn_nodes, vec_nodes)
+    
+    if with_reranker:
+        reranker = get_reranker(reranker_top_n)
+        # Cross-encoder считает все пары (запрос, документ) одним батчем; выносим расчет из event loop
+        retrieved_nodes = await asyncio.to_thread(reranker.postprocess_nodes, retrieved_nodes, query_bundle)
     
     return retrieved_nodes
 
 
+def make_check_response(result, facts):
+    """Формирование ответа API из результата проверки фактов"""
+    return ContradictionCheckResponse(
+        has_conflicts=result.has_conflicts,
+        has_supporting_facts=result.has_supporting_facts,
+        inconsistencies=result.inconsistencies,
+        supporting_facts=result.supporting_facts,
+        confidence=result.confidence,
+        explanation=result.explanation,
+        relevant_facts_count=len(facts)
+    )
+
+
+def response_cache_key(request):
+    """Ключ кэша ответа: хэш текста и параметры поиска"""
+    text_hash = hashlib.sha256(request.text.encode()).hexdigest()
+    return f"{app_state.index_generation}:{text_hash}:{request.vector_top_k}:{request.reranker_top_n}:{request.with_reranker}:{request.language}"
+
+
+def get_cached_response(key):
+    """Получение ответа из кэша с учетом времени жизни"""
+    cached = app_state.responses.get(key)
+    if cached is None:
+        return None
+    created, response = cached
+    if time.monotonic() - created > RESPONSE_CACHE_TTL:
+        app_state.responses.pop(key, None)
+        return None
+    return response
+
+
+def put_cached_response(key, response):
+    """Сохранение ответа в кэш; при переполнении удаляется самая старая запись"""
+    app_state.responses.pop(key, None)
+    app_state.responses[key] = (time.monotonic(), response)
+    if len(app_state.responses) > RESPONSE_CACHE_SIZE:
+        del app_state.responses[next(iter(app_state.responses))]
+
+
 # API Endpoints
 @app.get("/")
 async def root():
@@ -175,17 +315,53 @@ async def root():
             "status": "/api/status",
             "build_index": "/api/build_index",
             "check_contradictions": "/api/check_contradictions",
+            "check_contradictions_stream": "/api/check_contradictions/stream",
             "clear_index": "/api/clear_index"
         }
     }
 
 
+@app.on_event("startup")
+async def startup():
+    """Открытие подключения к Neo4j при старте сервера"""
+    try:
+        app_state.graph_store = get_graph_store()
+    except HTTPException as e:
+        logger.warning(f"Neo4j недоступен при старте, подключение будет повторено позже: {e.detail}")
+
+
+async def warmup_models():
+    """Прогрев моделей и клиентов, чтобы первый запрос не платил за холодный старт"""
+    try:
+        await asyncio.to_thread(get_reranker, CheckContradictionsRequest.model_fields["reranker_top_n"].default)
+        # Запросы идут мимо кэшей эмбеддингов и ответов LLM, иначе после первого запуска
+        # они отвечаются с диска и соединения не открываются. Все модели работают через
+        # один хост, поэтому достаточно прогреть синхронный пул и асинхронный пул цикла сервера
+        await asyncio.to_thread(emb_model.request_emb, "warmup")
+        await emb_model.request_emb_async("warmup")
+        logger.info("Прогрев моделей завершен")
+    except Exception as e:
+        logger.warning(f"Не удалось прогреть модели: {str(e)}")
+
+
+@app.on_event("startup")
+async def warmup():
+    """Запуск прогрева в фоне: сервер начинает принимать запросы, не дожидаясь загрузки моделей и сети"""
+    for language in ("en", "ru"):
+        get_checker(language)
+    
+    # Ссылка на задачу хранится, чтобы ее не удалил сборщик мусора
+    app_state.warmup_task = asyncio.create_task(warmup_models())
+
+
 @app.get("/api/status", response_model=StatusResponse)
 async def get_status():
     """Проверка статуса системы"""
     try:
-        # Проверяем подключение к Neo4j
-        graph_store = get_graph_store()
+        # Проверяем подключение к Neo4j, переиспользуя открытое соединение
+        if app_state.graph_store is None:
+            app_state.graph_store = get_graph_store()
+        await asyncio.to_thread(app_state.graph_store.client.verify_connectivity)
         database_connected = True
         
         # Проверяем наличие индекса
@@ -193,11 +369,22 @@ async def get_status():
         
         nodes_count = None
         if index_exists:
-            try:
-                # Попытка получить количество узлов
-                nodes_count = len(app_state.graph_index.property_graph_store.get_triplets())
-            except:
-                pass
+            now = time.monotonic()
+            if app_state.triplets_count is not None and now - app_state.triplets_count_time < TRIPLETS_COUNT_TTL:
+                nodes_count = app_state.triplets_count
+            else:
+                try:
+                    # Попытка получить количество узлов
+                    generation = app_state.index_generation
+                    nodes_count = await asyncio.to_thread(
+                        count_triplets, app_state.graph_index.property_graph_store
+                    )
+                    # Не кэшируем количество, если индекс успел перестроиться
+                    if generation == app_state.index_generation:
+                        app_state.triplets_count = nodes_count
+                        app_state.triplets_count_time = now
+                except:
+                    pass
         
         return StatusResponse(
             database_connected=database_connected,
@@ -227,58 +414,76 @@ async def build_index(
     """
     logger.info(f"Получен запрос на построение индекса. Файлов: {len(files)}, chunker: {chunker}")
     
-    try:
-        # Создаем временную директорию для файлов
-        if app_state.temp_dir:
-            shutil.rmtree(app_state.temp_dir, ignore_errors=True)
-        
-        app_state.temp_dir = tempfile.mkdtemp()
-        logger.info(f"Создана временная директория: {app_state.temp_dir}")
-        
-        # Сохраняем загруженные файлы
-        for file in files:
-            file_path = os.path.join(app_state.temp_dir, file.filename)
-            with open(file_path, "wb") as f:
-                content = await file.read()
-                f.write(content)
-            logger.info(f"Сохранен файл: {file.filename}")
-        
-        # Получаем graph store
-        if not app_state.graph_store:
-            app_state.graph_store = get_graph_store()
-        
-        # Создаем Data объект и получаем chunks
-        data_processor = Data(
-            input_promt="",  # Не используется при построении индекса
-            data_path=app_state.temp_dir,
-            format="text",
-            chunker=chunker
-        )
-        
-        logger.info("Начало обработки документов и создания chunks...")
-        nodes = data_processor.node_getter()
-        logger.info(f"Создано {len(nodes)} узлов")
-        
-        # Строим PropertyGraphIndex
-        logger.info("Начало построения PropertyGraphIndex...")
-        app_state.graph_index = PropertyGraphIndex(
-            nodes=nodes,
-            llm=custom_llm,
-            property_graph_store=app_state.graph_store,
-            embed_model=custom_embedder,
-            include_embeddings=True,
-        )
-        logger.info("PropertyGraphIndex успешно построен")
-        
-        return BuildIndexResponse(
-            status="success",
-            message=f"Индекс успешно построен из {len(files)} файлов",
-            nodes_count=len(nodes)
-        )
-        
-    except Exception as e:
-        logger.error(f"Ошибка при построении индекса: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Ошибка при построении индекса: {str(e)}")
+    # Построение и очистка индекса выполняются по одной: иначе параллельный запрос
+    # удалит временную директорию или подменит индекс во время построения
+    async with app_state.index_lock:
+        try:
+            # Создаем временную директорию для файлов
+            if app_state.temp_dir:
+                shutil.rmtree(app_state.temp_dir, ignore_errors=True)
+            
+            temp_dir = tempfile.mkdtemp()
+            app_state.temp_dir = temp_dir
+            logger.info(f"Создана временная директория: {temp_dir}")
+            
+            # Сохраняем загруженные файлы параллельно
+            await asyncio.gather(*[
+                save_upload(file, file_path) for file, file_path in zip(files, upload_paths(files, temp_dir))
+            ])
+            
+            # Получаем graph store
+            if not app_state.graph_store:
+                app_state.graph_store = get_graph_store()
+            
+            # Создаем Data объект и получаем chunks
+            data_processor = Data(
+                input_promt="",  # Не используется при построении индекса
+                data_path=temp_dir,
+                format="text",
+                chunker=chunker
+            )
+            
+            logger.info("Начало обработки документов и создания chunks...")
+            nodes = await data_processor.anode_getter()
+            logger.info(f"Создано {len(nodes)} узлов")
+            
+            # Создаем HNSW-индекс с int8-квантованием до того, как Neo4jPGStore создаст индекс по умолчанию
+            if nodes:
+                try:
+                    embedding = await asyncio.to_thread(custom_embedder.get_text_embedding, nodes[0].get_content())
+                    await asyncio.to_thread(create_vector_index, app_state.graph_store, len(embedding))
+                except Exception as e:
+                    logger.warning(f"Не удалось создать векторный индекс с квантованием: {str(e)}")
+            
+            # Строим PropertyGraphIndex в отдельном потоке. Экстракторы триплетов запускают в нем
+            # собственный event loop, поэтому асинхронные клиенты LLM создаются для каждого цикла
+            # отдельно (см. YandexCloudLLM.async_client); эмбеддинги считаются синхронно пакетами
+            logger.info("Начало построения PropertyGraphIndex...")
+            app_state.graph_index = await asyncio.to_thread(
+                PropertyGraphIndex,
+                nodes=nodes,
+                llm=custom_llm,
+                kg_extractors=get_kg_extractors(),
+                property_graph_store=app_state.graph_store,
+                embed_model=custom_embedder,
+                include_embeddings=True,
+                use_async=False,
+            )
+            app_state.index_generation += 1
+            app_state.triplets_count = None
+            app_state.retrievers.clear()
+            app_state.responses.clear()
+            logger.info("PropertyGraphIndex успешно построен")
+            
+            return BuildIndexResponse(
+                status="success",
+                message=f"Индекс успешно построен из {len(files)} файлов",
+                nodes_count=len(nodes)
+            )
+            
+        except Exception as e:
+            logger.error(f"Ошибка при построении индекса: {str(e)}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"Ошибка при построении индекса: {str(e)}")
 
 
 @app.post("/api/check_contradictions", response_model=ContradictionCheckResponse)
@@ -298,10 +503,16 @@ async def check_contradictions(request: CheckContradictionsRequest):
             detail="Индекс не построен. Сначала загрузите файлы через /api/build_index"
         )
     
+    cache_key = response_cache_key(request)
+    cached_response = get_cached_response(cache_key)
+    if cached_response is not None:
+        logger.info("Ответ найден в кэше")
+        return cached_response
+    
     try:
         # Получаем релевантные узлы
         logger.info("Поиск релевантных узлов...")
-        retrieved_nodes = get_retrieved_nodes(
+        retrieved_nodes = await get_retrieved_nodes(
             app_state.graph_index,
             request.text,
             vector_top_k=request.vector_top_k,
@@ -311,61 +522,107 @@ async def check_contradictions(request: CheckContradictionsRequest):
         logger.info(f"Найдено {len(retrieved_nodes)} релевантных узлов")
         
         # Извлекаем факты из узлов
-        facts = []
-        for node in retrieved_nodes:
-            text = str(node.node.get_text())
-            facts.append(text)
+        facts = [node.node.get_text() for node in retrieved_nodes]
         
         # Проверяем противоречия с выбранным языком
         logger.info(f"Проверка фактов через LLM (язык: {request.language})...")
         
-        # Создаем checker с выбранным языком
-        from src.llm_service import YandexCloudLLM
-        from src.fact_checker import FactConsistencyChecker
-        llm_service = YandexCloudLLM(
-            api_key=tokens.AUTH_TOKEN,
-            folder_id=tokens.FOLDER_ID,
-            model_uri="yandexgpt-lite",
-            temperature=0.1
-        )
-        language_checker = FactConsistencyChecker(llm_service=llm_service, language=request.language)
+        # Получаем checker с выбранным языком
+        language_checker = get_checker(request.language)
         
-        result = language_checker.check_facts(request.text, facts)
+        result = await asyncio.to_thread(language_checker.check_facts, request.text, facts)
         logger.info("Проверка завершена")
         
-        return ContradictionCheckResponse(
-            has_conflicts=result.has_conflicts,
-            has_supporting_facts=result.has_supporting_facts,
-            inconsistencies=result.inconsistencies,
-            supporting_facts=result.supporting_facts,
-            confidence=result.confidence,
-            explanation=result.explanation,
-            relevant_facts_count=len(facts)
-        )
+        response = make_check_response(result, facts)
+        put_cached_response(cache_key, response)
+        return response
         
     except Exception as e:
         logger.error(f"Ошибка при проверке противоречий: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка при проверке противоречий: {str(e)}")
 
 
+@app.post("/api/check_contradictions/stream")
+async def check_contradictions_stream(request: CheckContradictionsRequest):
+    """
+    Потоковая проверка текста на противоречия с базой знаний
+    
+    Возвращает NDJSON: по одному событию на каждый этап
+    (retrieving, retrieved, checking, result или error)
+    
+    Args:
+        request: Запрос с текстом для проверки и параметрами поиска
+    """
+    logger.info(f"Получен запрос на потоковую проверку противоречий для текста: {request.text[:100]}...")
+    
+    # Проверяем наличие индекса
+    if not app_state.graph_index:
+        raise HTTPException(
+            status_code=400,
+            detail="Индекс не построен. Сначала загрузите файлы через /api/build_index"
+        )
+    
+    def event(data):
+        return json.dumps(data, ensure_ascii=False) + "\n"
+    
+    cache_key = response_cache_key(request)
+    
+    async def events():
+        cached_response = get_cached_response(cache_key)
+        if cached_response is not None:
+            logger.info("Ответ найден в кэше")
+            yield event({"stage": "result", "result": cached_response.model_dump()})
+            return
+        
+        try:
+            yield event({"stage": "retrieving"})
+            retrieved_nodes = await get_retrieved_nodes(
+                app_state.graph_index,
+                request.text,
+                vector_top_k=request.vector_top_k,
+                reranker_top_n=request.reranker_top_n,
+                with_reranker=request.with_reranker
+            )
+            facts = [node.node.get_text() for node in retrieved_nodes]
+            yield event({"stage": "retrieved", "facts": facts})
+            
+            yield event({"stage": "checking"})
+            language_checker = get_checker(request.language)
+            result = await asyncio.to_thread(language_checker.check_facts, request.text, facts)
+            response = make_check_response(result, facts)
+            put_cached_response(cache_key, response)
+            yield event({"stage": "result", "result": response.model_dump()})
+            
+        except Exception as e:
+            logger.error(f"Ошибка при проверке противоречий: {str(e)}", exc_info=True)
+            yield event({"stage": "error", "detail": f"Ошибка при проверке противоречий: {str(e)}"})
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
 @app.delete("/api/clear_index")
 async def clear_index():
     """Очистка индекса и временных файлов"""
-    try:
-        # Очищаем индекс
-        app_state.graph_index = None
-        
-        # Удаляем временные файлы
-        if app_state.temp_dir:
-            shutil.rmtree(app_state.temp_dir, ignore_errors=True)
-            app_state.temp_dir = None
-        
-        logger.info("Индекс очищен")
-        
-        return {"status": "success", "message": "Индекс успешно очищен"}
-    except Exception as e:
-        logger.error(f"Ошибка при очистке индекса: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Ошибка при очистке индекса: {str(e)}")
+    async with app_state.index_lock:
+        try:
+            # Очищаем индекс
+            app_state.graph_index = None
+            app_state.index_generation += 1
+            app_state.triplets_count = None
+            app_state.retrievers.clear()
+            app_state.responses.clear()
+            
+            # Удаляем временные файлы
+            if app_state.temp_dir:
+                shutil.rmtree(app_state.temp_dir, ignore_errors=True)
+                app_state.temp_dir = None
+            
+            logger.info("Индекс очищен")
+            
+            return {"status": "success", "message": "Индекс успешно очищен"}
+        except Exception as e:
+            logger.error(f"Ошибка при очистке индекса: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Ошибка при очистке индекса: {str(e)}")
 
 
 # Обработчик исключений
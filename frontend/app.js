@@ -264,7 +264,7 @@ async function checkContradictions() {
             language: document.getElementById('languageSelect').value
         };
 
-        const response = await fetch(`${API_BASE_URL}/api/check_contradictions`, {
+        const response = await fetch(`${API_BASE_URL}/api/check_contradictions/stream`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
@@ -277,7 +277,7 @@ async function checkContradictions() {
             throw new Error(error.detail || 'Ошибка при проверке противоречий');
         }
 
-        const result = await response.json();
+        const result = await readCheckStream(response);
         displayResults(result);
 
     } catch (error) {
@@ -290,6 +290,54 @@ async function checkContradictions() {
     }
 }
 
+// Чтение потокового ответа (NDJSON) с обновлением статуса по этапам
+async function readCheckStream(response) {
+    const loadingText = document.querySelector('#loadingIndicator p');
+    const stageTexts = {
+        retrieving: 'Ищем релевантные факты...',
+        checking: 'Проверяем факты...'
+    };
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    try {
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+
+            for (const line of lines) {
+                if (!line.trim()) {
+                    continue;
+                }
+                const event = JSON.parse(line);
+
+                if (event.stage === 'result') {
+                    return event.result;
+                }
+                if (event.stage === 'error') {
+                    throw new Error(event.detail);
+                }
+                if (event.stage === 'retrieved') {
+                    loadingText.textContent = `Найдено релевантных фактов: ${event.facts.length}`;
+                } else if (stageTexts[event.stage]) {
+                    loadingText.textContent = stageTexts[event.stage];
+                }
+            }
+        }
+    } finally {
+        loadingText.textContent = 'Анализируем текст...';
+    }
+
+    throw new Error('Соединение закрыто до получения результата');
+}
+
 // Отображение результатов
 function displayResults(result) {
     const resultsContainer = document.getElementById('resultsContainer');
@@ -1,13 +1,13 @@
 # python3 /path/to/text-preprocessing/main.py --input_json /path/to/text-preprocessing/input.json
 
-from src.graph_rag import custom_embedder, custom_llm
+from src.graph_rag import custom_embedder, custom_llm, get_kg_extractors
 import json
 from src import chunk_getter
 import argparse
 from llama_index.core import PropertyGraphIndex
 from src.fact_checker import checker
 from llama_index.core.postprocessor import LLMRerank
-from llama_index.core.prompts import PromptTemplate
+from src.prompts import CHOICE_SELECT_TEMPLATE
 from llama_index.graph_stores.neo4j import Neo4jPGStore
 import tokens
 
@@ -40,38 +40,11 @@ def get_retrieved_nodes(
 
     retrieved_nodes = retriever.retrieve(query_bundle)
     if with_reranker:
-        prompt_str = (
-            "A list of documents is shown below. Each document has a number next to it along with a summary of the document. A question is also provided. \n"
-            "Respond with the numbers of the documents you should consult to answer the question, in order of relevance, as well as the relevance score. The relevance score is a number from 1-10 based on how relevant you think the document is to the question.\n"
-            "Prioritize documents based on their relevance to the question, regardless of whether they support or contradict the query. Both confirming and contradicting facts are considered equally relevant if they provide significant information, context, or arguments related to the question.\n"
-            "Assign relevance scores in a balanced way to fairly represent differing viewpoints or data, ensuring that conflicting evidence is not overshadowed by other documents.\n"
-            "Always include at least one document in the response, selecting the most relevant documents even if the relevance is low.\n"
-            "Do not include documents that are irrelevant to the question.\n"
-            "Example format: \n"
-            "Document 1:\n<summary of document 1>\n\n"
-            "Document 2:\n<summary of document 2>\n\n"
-            "...\n\n"
-            "Document 10:\n<summary of document 10>\n\n"
-            "Question: <question>\n"
-            "Answer:\n"
-            "Doc: 9, Relevance: 7\n"
-            "Doc: 3, Relevance: 4\n"
-            "Doc: 7, Relevance: 3\n\n"
-            "Let's try this now: \n\n"
-            "{context_str}\n"
-            "Question: {query_str}\n"
-            "Answer:\n"
-        )
-
-        custom_choice_template = PromptTemplate(
-            template=prompt_str
-        )
-
         reranker = LLMRerank(
             llm=custom_llm,
             choice_batch_size=5,
             top_n=reranker_top_n,
-            choice_select_prompt=custom_choice_template
+            choice_select_prompt=CHOICE_SELECT_TEMPLATE
         )
 
         retrieved_nodes = reranker.postprocess_nodes(retrieved_nodes, query_bundle)
@@ -106,6 +79,7 @@ def main():
         graph_index = PropertyGraphIndex(
             nodes=nodes,
             llm=custom_llm,
+            kg_extractors=get_kg_extractors(),
             property_graph_store=graph_store,
             embed_model=custom_embedder,
             include_embeddings=True,
@@ -113,10 +87,7 @@ def main():
 
     retrieved_nodes = get_retrieved_nodes(graph_index, custom_llm, custom_embedder, data.input_promt, vector_top_k=30, reranker_top_n=5, with_reranker=True)
 
-    facts = []
-    for node in retrieved_nodes:
-        text = str(node.node.get_text())
-        facts.append(text)
+    facts = [node.node.get_text() for node in retrieved_nodes]
 
     # Создаем checker с выбранным языком
     from src.llm_service import YandexCloudLLM
@@ -3,9 +3,21 @@ from llama_index.core.node_parser import (
     SimpleNodeParser,
     SentenceSplitter
 )
-from yandex_cloud_ml_sdk import YCloudML
+from yandex_cloud_ml_sdk import AsyncYCloudML
+from pathlib import Path
+import asyncio
+import hashlib
+import pickle
+import re
 import  tokens
 
+# Граница предложения: пробел после завершающего знака препинания. Не режет десятичные дроби (3.5),
+# но сокращения с точкой ("Dr. Smith") по-прежнему разбиваются
+_SENT_SPLIT_RE = re.compile(r"(?<=[.!?])\s+")
+
+# Размер блока при хэшировании файлов для ключа кэша (1 МиБ)
+_HASH_BLOCK_SIZE = 1 << 20
+
 class Data:
     def __init__(self,
                  input_promt: str,
@@ -13,14 +25,28 @@ class Data:
                  format:str = "text",
                  chunker:str = "basic",
                  chunk_size = 500,
-                 chunk_overlap = 75):
+                 chunk_overlap = 75,
+                 max_concurrency = 8,
+                 cache_dir: str = "cache/nodes"):
         self.input_promt = input_promt
         self.data_path = data_path
         self.format = format
         self.chunker = chunker
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        self.sdk = YCloudML(
+        self.max_concurrency = max_concurrency
+        self.cache_dir = cache_dir
+
+        # Функции загрузки и чанкинга выбираются один раз при создании объекта
+        load_fns = {"text": self._load_text, "csv": self._load_csv}
+        chunk_fns = {"basic": self._abasic_chunks, "LLM": self.allm_chunks}
+        if format not in load_fns:
+            raise ValueError(f"Неизвестный формат данных: {format}")
+        if chunker not in chunk_fns:
+            raise ValueError(f"Неизвестный тип чанкера: {chunker}")
+        self._load_fn = load_fns[format]
+        self._chunk_fn = chunk_fns[chunker]
+        self.sdk = AsyncYCloudML(
           folder_id=tokens.FOLDER_ID,
           auth=tokens.AUTH_TOKEN,
         )
@@ -31,44 +57,108 @@ class Data:
         nodes = base_splitter.get_nodes_from_documents(docs)
         return nodes
 
-    def llm_chunks(self, docs: list[str]):
-        new_docs = []
+    async def _abasic_chunks(self, docs: list[str]):
+        # Разбиение выполняется в потоке, чтобы не блокировать event loop
+        return await asyncio.to_thread(self.basic_chunks, docs)
 
-        for doc in docs:
-            messages = [
-                {
-                    "role": "user",
-                    "text": "Rewrite the text so that each sentence contains exactly one fact. Leave the sequence of events unchanged",
-                },
-                {
-                    "role": "user",
-                    "text": str(doc),
-                }
-            ]
-            new_chunks = (
+    async def _rewrite(self, doc, semaphore: asyncio.Semaphore) -> str:
+        messages = [
+            {
+                "role": "user",
+                "text": "Rewrite the text so that each sentence contains exactly one fact. Leave the sequence of events unchanged",
+            },
+            {
+                "role": "user",
+                "text": str(doc),
+            }
+        ]
+        async with semaphore:
+            new_chunks = await (
                 self.sdk.models.completions("yandexgpt-lite").configure(temperature=0.5).run(messages)
             )
-            
-            assert len(new_chunks.text) != 0, "no result"
 
-            new_doc = new_chunks.text
-            sents = new_doc.split(".")
-            new_docs.extend([sent for sent in sents if sent.strip()])
+        assert len(new_chunks.text) != 0, "no result"
+        return new_chunks.text
+
+    async def allm_chunks(self, docs: list[str]):
+        # Документы переписываются параллельно, семафор ограничивает число одновременных запросов
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        rewritten = await asyncio.gather(*[self._rewrite(doc, semaphore) for doc in docs])
 
-        docs = [Document(text=doc) for doc in new_docs]
+        new_docs = []
+        for doc, new_doc in zip(docs, rewritten):
+            new_docs.extend(
+                Document(
+                    text=sent.strip(),
+                    metadata=doc.metadata,
+                    # Служебные поля файла не должны попадать в эмбеддинг и промпт извлечения триплетов
+                    excluded_embed_metadata_keys=doc.excluded_embed_metadata_keys,
+                    excluded_llm_metadata_keys=doc.excluded_llm_metadata_keys,
+                )
+                for sent in _SENT_SPLIT_RE.split(new_doc) if sent.strip()
+            )
+
+        docs = new_docs
         parser = SentenceSplitter()
         return parser.get_nodes_from_documents(docs)
 
-    def node_getter(self):
-        docs = []
-        if self.format == "text":
-            docs = SimpleDirectoryReader(input_dir=self.data_path, recursive=True).load_data()
-        if self.format == "csv":
-            pass
-    
+    def llm_chunks(self, docs: list[str]):
+        return asyncio.run(self.allm_chunks(docs))
+
+    def _load_text(self):
+        return SimpleDirectoryReader(input_dir=self.data_path, recursive=True).load_data()
+
+    def _load_csv(self):
+        return []
+
+    def _cache_path(self, file_path: Path) -> Path:
+        # Ключ кэша: содержимое файла и параметры чанкинга; файл хэшируется по частям,
+        # чтобы не читать его в память целиком
+        digest = hashlib.blake2b(digest_size=16)
+        with open(file_path, "rb") as f:
+            while block := f.read(_HASH_BLOCK_SIZE):
+                digest.update(block)
+        digest.update(f"{self.chunker}|{self.chunk_size}|{self.chunk_overlap}".encode())
+        return Path(self.cache_dir) / f"{digest.hexdigest()}.pkl"
+
+    def _scan_cache(self):
+        # Список файлов, пути к их кэшу и файлы, которых в кэше еще нет
+        files = SimpleDirectoryReader(input_dir=self.data_path, recursive=True).input_files
+        cache_paths = [self._cache_path(Path(file)) for file in files]
+        missing = [file for file, cache_path in zip(files, cache_paths) if not cache_path.exists()]
+        return files, cache_paths, missing
+
+    def _collect_nodes(self, files, cache_paths, new_nodes):
+        # Узлы из кэша для старых файлов и сохранение в кэш узлов новых файлов
         nodes = []
-        if self.chunker == "basic":
-            nodes = self.basic_chunks(docs)
-        if self.chunker == "LLM":
-            nodes = self.llm_chunks(docs)
+        for file, cache_path in zip(files, cache_paths):
+            if cache_path.exists():
+                with open(cache_path, "rb") as f:
+                    nodes.extend(pickle.load(f))
+            else:
+                file_nodes = new_nodes.get(str(file), [])
+                cache_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(cache_path, "wb") as f:
+                    pickle.dump(file_nodes, f)
+                nodes.extend(file_nodes)
         return nodes
+
+    async def anode_getter(self):
+        # Чтение и разбор файлов, хэширование и работа с кэшем выполняются в потоках,
+        # в event loop остаются только запросы к LLM
+        if self.format != "text" or not self.cache_dir:
+            return await self._chunk_fn(await asyncio.to_thread(self._load_fn))
+
+        files, cache_paths, missing = await asyncio.to_thread(self._scan_cache)
+
+        # Разбираем и чанкуем только файлы, которых еще нет в кэше
+        new_nodes = {}
+        if missing:
+            docs = await asyncio.to_thread(SimpleDirectoryReader(input_files=missing).load_data)
+            for node in await self._chunk_fn(docs):
+                new_nodes.setdefault(node.metadata.get("file_path"), []).append(node)
+
+        return await asyncio.to_thread(self._collect_nodes, files, cache_paths, new_nodes)
+
+    def node_getter(self):
+        return asyncio.run(self.anode_getter())
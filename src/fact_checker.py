@@ -1,13 +1,83 @@
-from typing import List, Dict, Any, Optional, Union
-from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Tuple, Union
+import msgspec
+from functools import lru_cache
 import logging
 from pathlib import Path
-import json
+import orjson
+import re
+import fastjsonschema
+from tenacity import retry, stop_after_attempt, wait_random_exponential, retry_if_exception_type, RetryCallState
 from .llm_service import YandexCloudLLM
 import tokens
 
-@dataclass
-class FactCheckResult:
+# Markdown-ограждение блока кода в начале (```json или ```) и в конце ответа
+_FENCE_RE = re.compile(r"\A\s*```(?:json)?\s*|\s*```\s*\Z")
+
+# Элемент списков inconsistencies и supporting_facts
+_ITEM_SCHEMA = {
+    "type": "object",
+    "required": ["statement", "fact", "explanation"],
+}
+
+# Схема ответа LLM; валидатор компилируется один раз при импорте модуля
+_validate_schema = fastjsonschema.compile({
+    "type": "object",
+    "required": [
+        "has_conflicts",
+        "has_supporting_facts",
+        "inconsistencies",
+        "supporting_facts",
+        "confidence",
+        "explanation",
+    ],
+    "properties": {
+        "has_conflicts": {"type": "boolean"},
+        "has_supporting_facts": {"type": "boolean"},
+        "inconsistencies": {"type": "array", "items": _ITEM_SCHEMA},
+        "supporting_facts": {"type": "array", "items": _ITEM_SCHEMA},
+        "confidence": {"type": "number"},
+        "explanation": {"type": "string"},
+    },
+})
+
+# Корень проекта (вычисляется один раз при импорте)
+_PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+def _resolve_prompt(language: str) -> Path:
+    """
+    Определение пути к файлу системного промпта для языка.
+    
+    Args:
+        language: Язык промпта ("en" или "ru")
+    
+    Returns:
+        Путь к файлу промпта
+    """
+    prompt_filename = f"system_prompt_{'eng' if language == 'en' else 'ru'}.txt"
+    
+    # Ищем файл в папке prompts относительно корня проекта
+    prompt_path = _PROJECT_ROOT / "prompts" / prompt_filename
+    
+    if not prompt_path.exists():
+        # Fallback на старое расположение
+        prompt_path = _PROJECT_ROOT / prompt_filename
+    
+    return prompt_path
+
+@lru_cache(maxsize=4)
+def _load_prompt(language: str) -> str:
+    """
+    Чтение системного промпта для языка (файл читается один раз за время жизни процесса).
+    
+    Args:
+        language: Язык промпта ("en" или "ru")
+    
+    Returns:
+        Текст системного промпта
+    """
+    return _resolve_prompt(language).read_text(encoding="utf-8")
+
+class FactCheckResult(msgspec.Struct):
     """Результат проверки фактов"""
     has_conflicts: bool  # Есть ли противоречия
     has_supporting_facts: bool  # Есть ли подтверждающие факты
@@ -17,6 +87,9 @@ class FactCheckResult:
     relevant_facts: List[str]  # Использованные для проверки факты
     explanation: str  # Объяснение результата
 
+# Поля FactCheckResult, которые заполняются из ответа LLM
+_RESPONSE_FIELDS: Tuple[str, ...] = tuple(name for name in FactCheckResult.__struct_fields__ if name != "relevant_facts")
+
 class FactConsistencyChecker:
     """
     Основной класс для проверки фактологической согласованности текстов.
@@ -41,6 +114,7 @@ class FactConsistencyChecker:
         self.llm_service = llm_service
         self.config = config
         self.language = language
+        self._system_prompt = _load_prompt(language)
         
         self.logger = logging.getLogger(__name__)
         self._setup_logging()
@@ -79,44 +153,48 @@ class FactConsistencyChecker:
                 max_tokens=self.config[1]
             )
 
-            # Парсим ответ LLM в JSON с повторными попытками исправления
+            # Парсим ответ LLM в JSON; при ошибке запрашиваем исправление с экспоненциальной
+            # задержкой со случайным разбросом (на случай обрезанного из-за перегрузки ответа)
             max_attempts = 5
+            error: Optional[ValueError] = None
             
-            for attempt in range(max_attempts):
-                try:
-                    # Очищаем ответ от markdown разметки
-                    cleaned_response = self._clean_json_response(llm_response)
-                    parsed_result = json.loads(cleaned_response)
-                    self._validate_response(parsed_result)
-                    break
-                    
-                except (json.JSONDecodeError, ValueError) as e:
-                    print(llm_response)
-                    if attempt < max_attempts - 1:
-                        # Если это не последняя попытка, отправляем запрос на исправление
-                        self.logger.warning(f"Попытка {attempt + 1}: Ошибка парсинга JSON: {str(e)}")
-                        self.logger.info("Отправляем запрос на исправление JSON формата...")
-                        
-                        correction_prompt = f"""Ваш предыдущий ответ имел некорректный JSON формат. 
-Пожалуйста, исправьте его и верните ТОЛЬКО корректный JSON без markdown разметки, без дополнительного текста, без тройных кавычек.
-
-Ваш предыдущий ответ:
-{llm_response}
-
-Ошибка: {str(e)}
-
-Верните исправленный JSON в правильном формате (только JSON, без ```):"""
-                        
-                        llm_response = self.llm_service.analyze_consistency(
-                            prompt=correction_prompt,
-                            system_prompt="Вы - помощник для исправления JSON формата. Верните ТОЛЬКО корректный JSON без markdown разметки, без тройных кавычек, без дополнительного текста.",
-                            temperature=0.1,
-                            max_tokens=1500
-                        )
-                    else:
-                        # Последняя попытка не удалась
-                        self.logger.error(f"Не удалось получить корректный JSON после {max_attempts} попыток")
-                        raise ValueError(f"Ошибка парсинга JSON ответа после {max_attempts} попыток: {str(e)}")
+            def log_retry(retry_state: RetryCallState) -> None:
+                self.logger.debug("Некорректный ответ LLM: %s", llm_response)
+                self.logger.warning(f"Попытка {retry_state.attempt_number}: Ошибка парсинга JSON: {str(error)}")
+                self.logger.info("Отправляем запрос на исправление JSON формата...")
+            
+            @retry(
+                stop=stop_after_attempt(max_attempts),
+                wait=wait_random_exponential(multiplier=1, max=8),
+                retry=retry_if_exception_type(ValueError),
+                before_sleep=log_retry,
+                reraise=True
+            )
+            def attempt_parse() -> Dict[str, Any]:
+                nonlocal llm_response, error
+                if error is not None:
+                    llm_response = self._request_json_fix(llm_response, error)
+                parsed, error = self._try_parse(llm_response)
+                if parsed is None:
+                    raise error
+                return parsed
+            
+            try:
+                parsed_result = attempt_parse()
+            except ValueError as e:
+                # Последняя попытка не удалась
+                self.logger.error(f"Не удалось получить корректный JSON после {max_attempts} попыток")
+                raise ValueError(f"Ошибка парсинга JSON ответа после {max_attempts} попыток: {str(e)}")
+            
+            # В кэш попадает только разобранный ответ: повторный запрос с тем же промптом
+            # не воспроизведет неудачную цепочку исправлений
+            self.llm_service.cache_consistency_response(
+                prompt=prompt,
+                system_prompt=system_prompt,
+                response=llm_response,
+                temperature=self.config[0],
+                max_tokens=self.config[1]
+            )
 
             
             # Парсим JSON в структуру FactCheckResult
@@ -133,6 +211,61 @@ class FactConsistencyChecker:
             self.logger.error(f"Ошибка при проверке фактов: {str(e)}")
             raise
 
+    def _try_parse(self, llm_response: str) -> Tuple[Optional[Dict[str, Any]], Optional[ValueError]]:
+        """
+        Очистка, разбор и валидация ответа LLM.
+        
+        Args:
+            llm_response: Сырой ответ от модели
+        
+        Returns:
+            (разобранный ответ, None) при успехе или (None, ошибка) при неудаче
+        """
+        try:
+            parsed = orjson.loads(self._clean_json_response(llm_response))
+            self._validate_response(parsed)
+            return parsed, None
+        except ValueError as e:
+            # orjson.JSONDecodeError и ошибки валидации схемы - подклассы ValueError
+            return None, e
+
+    def _request_json_fix(self, llm_response: str, error: ValueError) -> str:
+        """
+        Запрос к LLM на исправление некорректного JSON.
+        
+        Args:
+            llm_response: Некорректный ответ модели
+            error: Ошибка разбора или валидации
+        
+        Returns:
+            Новый ответ модели
+        """
+        # Модель должна вернуть JSON целиком, поэтому ответ передается полностью, но в минимальном виде:
+        # без markdown разметки, а если JSON синтаксически корректен (ошибка в структуре) - без пробелов
+        previous_response = self._clean_json_response(llm_response)
+        try:
+            previous_response = orjson.dumps(orjson.loads(previous_response)).decode()
+        except orjson.JSONDecodeError:
+            pass
+        
+        correction_prompt = f"""Ваш предыдущий ответ имел некорректный JSON формат. 
+Пожалуйста, исправьте его и верните ТОЛЬКО корректный JSON без markdown разметки, без дополнительного текста, без тройных кавычек.
+
+Ваш предыдущий ответ:
+{previous_response}
+
+Ошибка: {str(error)}
+
+Верните исправленный JSON в правильном формате (только JSON, без ```):"""
+        
+        return self.llm_service.analyze_consistency(
+            prompt=correction_prompt,
+            system_prompt="Вы - помощник для исправления JSON формата. Верните ТОЛЬКО корректный JSON без markdown разметки, без тройных кавычек, без дополнительного текста.",
+            temperature=0.1,
+            max_tokens=1500,
+            use_cache=False
+        )
+
     def _clean_json_response(self, response: str) -> str:
         """
         Очистка ответа от markdown разметки и других артефактов.
@@ -143,22 +276,8 @@ class FactConsistencyChecker:
         Returns:
             Очищенный JSON текст
         """
-        # Убираем markdown блоки кода
-        response = response.strip()
-        
-        # Удаляем тройные кавычки в начале и конце
-        if response.startswith("```json"):
-            response = response[7:]  # Убираем ```json
-        elif response.startswith("```"):
-            response = response[3:]  # Убираем ```
-            
-        if response.endswith("```"):
-            response = response[:-3]  # Убираем ``` в конце
-        
-        # Убираем лишние пробелы
-        response = response.strip()
-        
-        return response
+        # Убираем markdown блоки кода и лишние пробелы
+        return _FENCE_RE.sub("", response).strip()
     
     def _validate_response(self, response: Dict[str, Any]) -> None:
         """
@@ -170,53 +289,16 @@ class FactConsistencyChecker:
         Raises:
             ValueError: Если структура ответа некорректна
         """
-        required_fields = ['has_conflicts', 'inconsistencies', 'supporting_facts', 'confidence', 'explanation']
-        
-        # Проверяем наличие всех необходимых полей
-        if not all(field in response for field in required_fields):
-            raise ValueError("В ответе отсутствуют обязательные поля")
-        
-        # Проверяем типы данных
-        if not isinstance(response['has_conflicts'], bool):
-            raise ValueError("Поле 'has_conflicts' должно быть boolean")
-        
-        if not isinstance(response['has_supporting_facts'], bool):
-            raise ValueError("Поле 'has_supporting_facts' должно быть boolean")
-        
-        if not isinstance(response['inconsistencies'], list):
-            raise ValueError("Поле 'inconsistencies' должно быть списком")
-            
-        if not isinstance(response['supporting_facts'], list):
-            raise ValueError("Поле 'supporting_facts' должно быть списком")
-        
-        if not isinstance(response['confidence'], (int, float)):
-            raise ValueError("Поле 'confidence' должно быть числом")
+        # Проверяем наличие полей и типы данных (JsonSchemaValueException - подкласс ValueError)
+        _validate_schema(response)
         
-        if not isinstance(response['explanation'], str):
-            raise ValueError("Поле 'explanation' должно быть строкой")
-        
-        # Проверяем структуру inconsistencies
-        for inc in response['inconsistencies']:
-            if not all(k in inc for k in ['statement', 'fact', 'explanation']):
-                raise ValueError("Некорректная структура элемента inconsistencies")
-                
-        # Проверяем структуру supporting_facts
-        for sup in response['supporting_facts']:
-            if not all(k in sup for k in ['statement', 'fact', 'explanation']):
-                raise ValueError("Некорректная структура элемента supporting_facts")
-        # Удаляем элементы с пустыми фактами из списка противоречий
-        response['inconsistencies'] = [inc for inc in response['inconsistencies'] if inc.get('fact')]
-        
-        # Если после фильтрации список пустой, устанавливаем has_conflicts в False
-        if not response['inconsistencies']:
-            response['has_conflicts'] = False
-            
-        # Удаляем элементы с пустыми фактами из списка подтверждающих фактов
-        response['supporting_facts'] = [sup for sup in response['supporting_facts'] if sup.get('fact')]
-        
-        # Если после фильтрации список пустой, устанавливаем has_supporting_facts в False
-        if not response['supporting_facts']:
-            response['has_supporting_facts'] = False
+        # Удаляем элементы с пустыми фактами (на месте, без перепривязки списков);
+        # если список опустел, сбрасываем соответствующий флаг
+        for items_key, flag_key in (('inconsistencies', 'has_conflicts'), ('supporting_facts', 'has_supporting_facts')):
+            items = response[items_key]
+            items[:] = [item for item in items if item.get('fact')]
+            if not items:
+                response[flag_key] = False
 
     def _create_prompt(self, text: str, facts: List[str]) -> str:
         """
@@ -229,9 +311,13 @@ class FactConsistencyChecker:
         Returns:
             Промпт для LLM
         """
-        formatted_facts = "\n".join(f"- {fact}" for fact in facts)
-        prompt_template = f"""Input text to check: {text}
-        Known facts: {formatted_facts}"""
+        # Стабильная часть (факты в детерминированном порядке) идет первой, проверяемый текст - последним,
+        # чтобы одинаковые наборы фактов давали общий префикс для кэширования промпта на стороне провайдера
+        formatted_facts = "\n".join(f"- {fact}" for fact in sorted(set(facts)))
+        prompt_template = f"""Known facts:
+{formatted_facts}
+
+Input text to check: {text}"""
         
         return prompt_template
 
@@ -242,21 +328,7 @@ class FactConsistencyChecker:
         Returns:
             Системный промпт
         """
-        import os
-        
-        # Определяем путь к файлу промпта в зависимости от языка
-        prompt_filename = f"system_prompt_{'eng' if self.language == 'en' else 'ru'}.txt"
-        
-        # Ищем файл в папке prompts относительно корня проекта
-        project_root = Path(__file__).resolve().parent.parent
-        prompt_path = project_root / "prompts" / prompt_filename
-        
-        if not prompt_path.exists():
-            # Fallback на старое расположение
-            prompt_path = project_root / prompt_filename
-            
-        with open(prompt_path, "r", encoding="utf-8") as f:
-            return f.read()
+        return self._system_prompt
 
     def _parse_llm_response(
         self,
@@ -273,14 +345,10 @@ class FactConsistencyChecker:
         Returns:
             Структурированный результат проверки
         """
+        # Ответ уже провалидирован, поэтому поля берутся напрямую по списку имен
         return FactCheckResult(
-            has_conflicts=response["has_conflicts"],
-            has_supporting_facts=response["has_supporting_facts"],
-            inconsistencies=response["inconsistencies"],
-            supporting_facts=response["supporting_facts"],
-            confidence=response["confidence"],
-            relevant_facts=relevant_facts,
-            explanation=response["explanation"]
+            **{field: response[field] for field in _RESPONSE_FIELDS},
+            relevant_facts=relevant_facts
         )
         
 llm_service = YandexCloudLLM(
@@ -2,10 +2,26 @@ from llama_index.core.embeddings import BaseEmbedding
 from llama_index.core.llms import CustomLLM, LLMMetadata, CompletionResponse
 from yandex_cloud_ml_sdk import YCloudML
 from .llm_service import YandexCloudLLM
+from openai import BadRequestError, UnprocessableEntityError
 import tokens
 from llama_index.core.llms.callbacks import (
     llm_completion_callback,
 )
+from llama_index.core.retrievers import VectorContextRetriever
+from llama_index.core.indices.property_graph import SimpleLLMPathExtractor, ImplicitPathExtractor
+from .semantic_cache import SemanticCache
+from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+from cachetools import LRUCache
+import asyncio
+import hashlib
+import logging
+import threading
+import diskcache
+import numpy as np
+
+logger = logging.getLogger(__name__)
 
 EMB_URL="https://llm.api.cloud.yandex.net/foundationModels/v1/textEmbedding"
 GPT_URL="https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
@@ -13,35 +29,198 @@ GPT_URL="https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
 emb_model = YandexCloudLLM(tokens.AUTH_TOKEN, tokens.FOLDER_ID, EMB_URL, "text-search-doc", "emb")
 rag_model = YandexCloudLLM(tokens.AUTH_TOKEN, tokens.FOLDER_ID, GPT_URL, "yandexgpt")
 
-# Глобальный кэш для эмбеддингов в памяти
-_embeddings_cache = {}
+# Имя векторного индекса, который использует Neo4jPGStore для поиска по сущностям
+VECTOR_INDEX_NAME = "entity"
+
+
+def create_vector_index(graph_store, dimension: int, m: int = 32, ef_construction: int = 200) -> None:
+    """
+    Создание HNSW-индекса по эмбеддингам сущностей с int8-квантованием.
+    Должно вызываться до построения PropertyGraphIndex: иначе Neo4jPGStore
+    создаст индекс с настройками по умолчанию.
+
+    Args:
+        graph_store: Neo4jPGStore
+        dimension: Размерность эмбеддингов
+        m: Число связей вершины в графе HNSW
+        ef_construction: Размер списка кандидатов при построении HNSW
+    """
+    graph_store.structured_query(
+        f"""CREATE VECTOR INDEX {VECTOR_INDEX_NAME} IF NOT EXISTS
+        FOR (m:`__Entity__`) ON m.embedding
+        OPTIONS {{indexConfig: {{
+            `vector.dimensions`: {dimension},
+            `vector.similarity_function`: 'cosine',
+            `vector.quantization.enabled`: true,
+            `vector.hnsw.m`: {m},
+            `vector.hnsw.ef_construction`: {ef_construction}
+        }}}}"""
+    )
+
+def count_triplets(graph_store) -> int:
+    """Количество триплетов (связей между сущностями) в графе без их выгрузки"""
+    result = graph_store.structured_query(
+        "MATCH (:`__Entity__`)-[r]->(:`__Entity__`) RETURN count(r) AS count"
+    )
+    return result[0]["count"]
+
+# Постоянный кэш эмбеддингов на диске (переживает перезапуск сервера)
+EMB_CACHE_DIR = Path.home() / ".cache" / "fc_emb"
+_embeddings_cache = diskcache.Cache(str(EMB_CACHE_DIR))
+
+
+def _embedding_key(text: str) -> str:
+    return hashlib.sha256((emb_model.model + "\x00" + text).encode()).hexdigest()
+
+
+# Ограниченный LRU-кэш в памяти перед дисковым кэшем
+EMB_MEMORY_CACHE_SIZE = 50_000
+_memory_cache = LRUCache(maxsize=EMB_MEMORY_CACHE_SIZE)
+_lock = threading.RLock()
+# Выполняющиеся запросы: параллельные вызовы для того же текста ждут их результата,
+# а не отправляют повторный запрос
+_pending: dict[str, Future] = {}
+
+
+def _cached_vector(key: str) -> Optional[np.ndarray]:
+    with _lock:
+        vector = _memory_cache.get(key)
+    if vector is None:
+        cached = _embeddings_cache.get(key)
+        if cached is not None:
+            vector = np.frombuffer(cached, dtype=np.float32)
+            with _lock:
+                _memory_cache[key] = vector
+    return vector
+
+
+def _store_vector(key: str, embedding: list[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    _embeddings_cache[key] = vector.tobytes()
+    with _lock:
+        _memory_cache[key] = vector
+    return vector
+
+
+def _claim(key: str) -> tuple[Future, bool]:
+    """Возвращает (future, True), если запрос для ключа должен выполнить текущий вызов"""
+    with _lock:
+        future = _pending.get(key)
+        if future is not None:
+            return future, False
+        future = Future()
+        vector = _memory_cache.get(key)
+        if vector is not None:
+            future.set_result(vector)
+            return future, False
+        _pending[key] = future
+        return future, True
+
+
+def _resolve(key: str, future: Future, vector: Optional[np.ndarray] = None, error: Optional[BaseException] = None) -> None:
+    with _lock:
+        _pending.pop(key, None)
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(vector)
+
+
+def get_embedding(text: str) -> list[float]:
+    """Получение эмбеддинга текста через кэш; при промахе запрашивается у модели"""
+    key = _embedding_key(text)
+    vector = _cached_vector(key)
+    if vector is not None:
+        return vector.tolist()
+
+    future, owner = _claim(key)
+    if not owner:
+        return future.result().tolist()
+    try:
+        vector = _store_vector(key, emb_model.request_emb(text))
+    except BaseException as e:
+        # BaseException: при отмене задачи (CancelledError) ожидающие вызовы тоже должны получить результат
+        _resolve(key, future, error=e)
+        raise
+    _resolve(key, future, vector)
+    return vector.tolist()
+
+
+async def aget_embedding(text: str) -> list[float]:
+    """Асинхронный вариант get_embedding: при промахе кэша не блокирует event loop"""
+    key = _embedding_key(text)
+    vector = _cached_vector(key)
+    if vector is not None:
+        return vector.tolist()
+
+    future, owner = _claim(key)
+    if not owner:
+        return (await asyncio.wrap_future(future)).tolist()
+    try:
+        vector = _store_vector(key, await emb_model.request_emb_async(text))
+    except BaseException as e:
+        # BaseException: при отмене задачи (CancelledError) ожидающие вызовы тоже должны получить результат
+        _resolve(key, future, error=e)
+        raise
+    _resolve(key, future, vector)
+    return vector.tolist()
+
+
+# Принимает ли API список текстов в одном запросе (сбрасывается после первого отказа)
+_batch_supported = True
+# Число параллельных поштучных запросов, если пакетный запрос не поддерживается
+EMB_MAX_WORKERS = 8
+
+
+def _request_embeddings(texts: list[str]) -> list[list[float]]:
+    global _batch_supported
+    if _batch_supported:
+        try:
+            return emb_model.request_emb_batch(texts)
+        except (BadRequestError, UnprocessableEntityError) as e:
+            # Отказ принять список текстов; временные ошибки (таймауты, 429, 5xx) пробрасываются
+            logger.warning(f"Пакетный запрос эмбеддингов не поддерживается, переходим на параллельные запросы: {str(e)}")
+            _batch_supported = False
+
+    with ThreadPoolExecutor(max_workers=EMB_MAX_WORKERS) as executor:
+        return list(executor.map(emb_model.request_emb, texts))
+
+
+def get_embeddings(texts: list[str]) -> list[list[float]]:
+    """Получение эмбеддингов для списка текстов: из кэша, а недостающие - одним пакетом"""
+    keys = [_embedding_key(text) for text in texts]
+    embeddings = {}
+    for key in keys:
+        vector = _cached_vector(key)
+        if vector is not None:
+            embeddings[key] = vector.tolist()
+
+    missing = {key: text for text, key in zip(texts, keys) if key not in embeddings}
+    if missing:
+        for key, embedding in zip(missing, _request_embeddings(list(missing.values()))):
+            embeddings[key] = _store_vector(key, embedding).tolist()
+
+    return [embeddings[key] for key in keys]
+
 
 class CustomEmbeddingModel(BaseEmbedding):
     def __init__(self):
-        super().__init__(model_name="custom_embedder")
+        super().__init__(model_name="custom_embedder", embed_batch_size=64)
 
     def _get_query_embedding(self, query: str) -> list[float]:
-        # Проверяем кэш
-        if query in _embeddings_cache:
-            return _embeddings_cache[query]
-        
-        # Если нет в кэше, запрашиваем новый
-        embedding = emb_model.request_emb(query)
-        _embeddings_cache[query] = embedding
-        return embedding
+        return get_embedding(query)
 
     async def _aget_query_embedding(self, query: str) -> list[float]:
-        return self._get_query_embedding(query)
+        return await aget_embedding(query)
 
     def _get_text_embedding(self, text: str) -> list[float]:
-        # Проверяем кэш
-        if text in _embeddings_cache:
-            return _embeddings_cache[text]
-        
-        # Если нет в кэше, запрашиваем новый
-        embedding = emb_model.request_emb(text)
-        _embeddings_cache[text] = embedding
-        return embedding
+        return get_embedding(text)
+
+    async def _aget_text_embedding(self, text: str) -> list[float]:
+        return await aget_embedding(text)
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        return get_embeddings(texts)
 
 class CustomLLMAPI(CustomLLM):
     def __init__(self):
@@ -62,9 +241,56 @@ class CustomLLMAPI(CustomLLM):
     def metadata(self):
         return LLMMetadata()
 
-    def stream_complete(self, prompt, formatted, **kwargs):
-        ans = rag_model.request_gpt(prompt)
-        yield CompletionResponse(text=ans)
+    def stream_complete(self, prompt, formatted=False, **kwargs):
+        text = ""
+        for delta in rag_model.request_gpt_stream(prompt):
+            text += delta
+            yield CompletionResponse(text=text, delta=delta)
 
 custom_embedder = CustomEmbeddingModel()
 custom_llm = CustomLLMAPI()
+
+
+def get_kg_extractors(num_workers: int = 8):
+    """Экстракторы триплетов PropertyGraphIndex по умолчанию, но с большим числом параллельных запросов к LLM"""
+    return [
+        SimpleLLMPathExtractor(llm=custom_llm, num_workers=num_workers),
+        ImplicitPathExtractor(),
+    ]
+
+class CachedVectorContextRetriever(VectorContextRetriever):
+    """
+    VectorContextRetriever с семантическим кэшем результатов:
+    для запросов, близких к уже обработанным, векторный поиск и обход графа не выполняются.
+    """
+    def __init__(self, *args, cache_threshold: float = 0.97, cache_size: int = 1024, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cache = SemanticCache(threshold=cache_threshold, maxsize=cache_size)
+
+    def _retrieve(self, query_bundle):
+        if query_bundle.embedding is None:
+            query_bundle.embedding = self._embed_model.get_agg_embedding_from_queries(
+                query_bundle.embedding_strs
+            )
+        cached = self._cache.get(query_bundle.embedding)
+        if cached is not None:
+            # Копии: реранкер перезаписывает score узлов на месте
+            return [node.model_copy() for node in cached]
+
+        nodes = super()._retrieve(query_bundle)
+        self._cache.put(query_bundle.embedding, [node.model_copy() for node in nodes])
+        return nodes
+
+    async def _aretrieve(self, query_bundle):
+        if query_bundle.embedding is None:
+            query_bundle.embedding = await self._embed_model.aget_agg_embedding_from_queries(
+                query_bundle.embedding_strs
+            )
+        cached = self._cache.get(query_bundle.embedding)
+        if cached is not None:
+            # Копии: реранкер перезаписывает score узлов на месте
+            return [node.model_copy() for node in cached]
+
+        nodes = await super()._aretrieve(query_bundle)
+        self._cache.put(query_bundle.embedding, [node.model_copy() for node in nodes])
+        return nodes
@@ -1,8 +1,53 @@
-from typing import Optional
-from openai import OpenAI, AsyncOpenAI
-from tenacity import retry, stop_after_attempt, wait_exponential
-import requests
-import aiohttp
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from openai import OpenAI, AsyncOpenAI, BadRequestError, UnprocessableEntityError
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_not_exception_type
+from pathlib import Path
+import asyncio
+import hashlib
+import logging
+import threading
+import diskcache
+import httpx
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Общий HTTP/2 клиент для всех экземпляров YandexCloudLLM: один пул соединений
+# и одно TLS-рукопожатие вместо отдельного пула на каждый экземпляр
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+_SHARED_HTTP_CLIENT = httpx.Client(http2=True, limits=_HTTP_LIMITS, timeout=30)
+
+# Асинхронный пул соединений привязан к event loop, в котором открыты соединения,
+# поэтому асинхронные клиенты создаются отдельно для каждого цикла
+# (основной цикл сервера и циклы, которые llama-index запускает в рабочих потоках)
+_async_clients_lock = threading.RLock()
+# id(loop) -> (loop, клиент)
+_ASYNC_HTTP_CLIENTS: Dict[int, Tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = {}
+
+
+def _client_for_running_loop(clients: Dict[int, Tuple[asyncio.AbstractEventLoop, Any]], factory: Callable[[], Any]) -> Any:
+    """Клиент для текущего event loop из словаря clients; записи закрытых циклов удаляются"""
+    loop = asyncio.get_running_loop()
+    with _async_clients_lock:
+        for key in [key for key, (client_loop, _) in clients.items() if client_loop.is_closed()]:
+            del clients[key]
+        entry = clients.get(id(loop))
+        if entry is None:
+            entry = (loop, factory())
+            clients[id(loop)] = entry
+        return entry[1]
+
+
+def _get_async_http_client() -> httpx.AsyncClient:
+    """Общий асинхронный HTTP/2 клиент для текущего event loop"""
+    return _client_for_running_loop(
+        _ASYNC_HTTP_CLIENTS,
+        lambda: httpx.AsyncClient(http2=True, limits=_HTTP_LIMITS, timeout=30)
+    )
+
+# Кэш ответов LLM на диске: одинаковый запрос (модель, промпты, параметры) не отправляется повторно
+LLM_CACHE_DIR = Path.home() / ".cache" / "fc_llm"
+_LLM_CACHE = diskcache.Cache(str(LLM_CACHE_DIR))
 
 class YandexCloudLLM:
     """
@@ -37,18 +82,68 @@ class YandexCloudLLM:
             self.model_url = model_url
         self.client = OpenAI(
             api_key=api_key,
-            base_url="https://llm.api.cloud.yandex.net/v1"
-        )
-        self.async_client = AsyncOpenAI(
-            api_key=api_key,
-            base_url="https://llm.api.cloud.yandex.net/v1"
+            base_url="https://llm.api.cloud.yandex.net/v1",
+            http_client=_SHARED_HTTP_CLIENT
         )
+        # Асинхронные клиенты по event loop, см. async_client
+        self._async_clients = {}
 
         self.model = f"{model_type}://{folder_id}/{model_uri}/latest"
         self.temperature = temperature
         self.max_tokens = max_tokens
         self.timeout = timeout
 
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """Асинхронный клиент для текущего event loop (создается при первом обращении из цикла)"""
+        return _client_for_running_loop(
+            self._async_clients,
+            lambda: AsyncOpenAI(
+                api_key=self.api_key,
+                base_url="https://llm.api.cloud.yandex.net/v1",
+                http_client=_get_async_http_client()
+            )
+        )
+
+    def _cache_key(self, messages: list, temperature: float, max_tokens: int) -> str:
+        """Ключ кэша ответа: хэш модели, сообщений и параметров генерации"""
+        payload = orjson.dumps([self.model, temperature, max_tokens, messages])
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    def _consistency_cache_key(
+        self,
+        prompt: str,
+        system_prompt: str,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None
+    ) -> str:
+        """Ключ кэша ответа analyze_consistency (с теми же параметрами по умолчанию, что и у запроса)"""
+        messages = [
+            {
+                "role": "system",
+                "content": system_prompt
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+        return self._cache_key(messages, temperature or self.temperature, max_tokens or self.max_tokens)
+
+    def cache_consistency_response(
+        self,
+        prompt: str,
+        system_prompt: str,
+        response: str,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None
+    ) -> None:
+        """
+        Сохранение проверенного ответа analyze_consistency в кэш.
+        Вызывается только после успешного разбора ответа, чтобы некорректный JSON не закреплялся в кэше.
+        """
+        _LLM_CACHE[self._consistency_cache_key(prompt, system_prompt, temperature, max_tokens)] = response
+
     @retry(
         stop=stop_after_attempt(1),
         wait=wait_exponential(multiplier=1, min=4, max=10)
@@ -58,7 +153,8 @@ class YandexCloudLLM:
         prompt: str,
         system_prompt: str,
         temperature: Optional[float] = None,
-        max_tokens: Optional[int] = None
+        max_tokens: Optional[int] = None,
+        use_cache: bool = True
     ) -> str:
         """
         Анализ согласованности текста с помощью LLM.
@@ -67,6 +163,7 @@ class YandexCloudLLM:
             prompt: Промпт для модели
             temperature: Переопределение температуры (опционально)
             max_tokens: Переопределение максимального количества токенов (опционально)
+            use_cache: Искать ответ в кэше (в кэш ответ записывает cache_consistency_response)
         
         Returns:
             Структурированный ответ модели
@@ -76,31 +173,38 @@ class YandexCloudLLM:
             Exception: При других ошибках API
         """
         try:
+            messages = [
+                {
+                    "role": "system",
+                    "content": system_prompt
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
+            temperature = temperature or self.temperature
+            max_tokens = max_tokens or self.max_tokens
+
+            if use_cache:
+                cached = _LLM_CACHE.get(self._consistency_cache_key(prompt, system_prompt, temperature, max_tokens))
+                if cached is not None:
+                    return cached
+
             # Создаем запрос к API
             response = self.client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": system_prompt
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=temperature or self.temperature,
-                max_tokens=max_tokens or self.max_tokens,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
                 timeout=self.timeout
             )
             
             # Получаем ответ
-            result = response.choices[0].message.content
-
-            return result
+            return response.choices[0].message.content
             
-        except Exception as e:
-            print(f"Ошибка при запросе к LLM API: {str(e)}")
+        except Exception:
+            logger.exception("Ошибка при запросе к LLM API")
             raise
 
     @retry(
@@ -128,18 +232,64 @@ class YandexCloudLLM:
                 "content": prompt
             }
         ),
+        temperature = temperature or self.temperature
+        max_tokens = max_tokens or self.max_tokens
+
+        cache_key = self._cache_key(messages, temperature, max_tokens)
+        cached = _LLM_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
+
         response = self.client.chat.completions.create(
             model=self.model,
             messages=messages,
-            temperature=temperature or self.temperature,
-            max_tokens=max_tokens or self.max_tokens,
+            temperature=temperature,
+            max_tokens=max_tokens,
             timeout=self.timeout
         )
 
         result = response.choices[0].message.content
+        _LLM_CACHE[cache_key] = result
 
         return result
 
+    def request_gpt_stream(
+        self,
+        prompt: str,
+        system_prompt: str = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None
+    ) -> Iterator[str]:
+        """
+        Потоковая генерация: фрагменты ответа возвращаются по мере их получения от API.
+        """
+        messages = []
+        if system_prompt:
+            messages.append(
+                {
+                    "role": "system",
+                    "content": system_prompt
+                }
+            )
+        messages.append(
+            {
+                "role": "user",
+                "content": prompt
+            }
+        )
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature or self.temperature,
+            max_tokens=max_tokens or self.max_tokens,
+            timeout=self.timeout,
+            stream=True
+        )
+
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=4, max=10)
@@ -159,6 +309,43 @@ class YandexCloudLLM:
         .embedding
         )
 
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10)
+    )
+    async def request_emb_async(
+        self,
+        text: str = None
+    ) -> List[float]:
+        response = await self.async_client.embeddings.create(
+            input=text,
+            model=self.model,
+            encoding_format="float",
+        )
+        return response.data[0].embedding
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        retry=retry_if_not_exception_type((BadRequestError, UnprocessableEntityError)),
+        reraise=True
+    )
+    def request_emb_batch(
+        self,
+        texts: List[str]
+    ) -> List[List[float]]:
+        """
+        Получение эмбеддингов для списка текстов одним запросом.
+        Временные ошибки повторяются; отказ API принять список (400/422) пробрасывается сразу,
+        чтобы вызывающий код перешел на поштучные запросы.
+        """
+        response = self.client.embeddings.create(
+            input=texts,
+            model=self.model,
+            encoding_format="float",
+        )
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=4, max=10)
@@ -185,18 +372,27 @@ class YandexCloudLLM:
                     "content": prompt
                 }
             ),
+            temperature = temperature or self.temperature
+            max_tokens = max_tokens or self.max_tokens
+
+            cache_key = self._cache_key(messages, temperature, max_tokens)
+            cached = _LLM_CACHE.get(cache_key)
+            if cached is not None:
+                return cached
+
             response = await self.async_client.chat.completions.create(
                 model=self.model,
                 messages=messages,
-                temperature=temperature or self.temperature,
-                max_tokens=max_tokens or self.max_tokens,
+                temperature=temperature,
+                max_tokens=max_tokens,
                 timeout=self.timeout
             )
 
             result = response.choices[0].message.content
+            _LLM_CACHE[cache_key] = result
 
             return result
 
-        except Exception as e:
-            print(f"Ошибка при запросе к LLM API: {str(e)}")
+        except Exception:
+            logger.exception("Ошибка при запросе к LLM API")
             raise
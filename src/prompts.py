@@ -0,0 +1,27 @@
+from llama_index.core.prompts import PromptTemplate
+
+# Промпт для LLMRerank: подтверждающие и противоречащие факты считаются одинаково релевантными
+CHOICE_SELECT_PROMPT_STR = (
+    "A list of documents is shown below. Each document has a number next to it along with a summary of the document. A question is also provided. \n"
+    "Respond with the numbers of the documents you should consult to answer the question, in order of relevance, as well as the relevance score. The relevance score is a number from 1-10 based on how relevant you think the document is to the question.\n"
+    "Prioritize documents based on their relevance to the question, regardless of whether they support or contradict the query. Both confirming and contradicting facts are considered equally relevant if they provide significant information, context, or arguments related to the question.\n"
+    "Assign relevance scores in a balanced way to fairly represent differing viewpoints or data, ensuring that conflicting evidence is not overshadowed by other documents.\n"
+    "Always include at least one document in the response, selecting the most relevant documents even if the relevance is low.\n"
+    "Do not include documents that are irrelevant to the question.\n"
+    "Example format: \n"
+    "Document 1:\n<summary of document 1>\n\n"
+    "Document 2:\n<summary of document 2>\n\n"
+    "...\n\n"
+    "Document 10:\n<summary of document 10>\n\n"
+    "Question: <question>\n"
+    "Answer:\n"
+    "Doc: 9, Relevance: 7\n"
+    "Doc: 3, Relevance: 4\n"
+    "Doc: 7, Relevance: 3\n\n"
+    "Let's try this now: \n\n"
+    "{context_str}\n"
+    "Question: {query_str}\n"
+    "Answer:\n"
+)
+
+CHOICE_SELECT_TEMPLATE = PromptTemplate(template=CHOICE_SELECT_PROMPT_STR)
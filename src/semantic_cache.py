@@ -0,0 +1,65 @@
+from typing import Any, List, Optional
+import threading
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Кэш, в котором ключом выступает эмбеддинг запроса.
+    Значение возвращается, если косинусная близость к одному из
+    сохраненных эмбеддингов не ниже порога.
+    """
+
+    def __init__(self, threshold: float = 0.97, maxsize: int = 1024):
+        """
+        Инициализация кэша.
+
+        Args:
+            threshold: Минимальная косинусная близость для попадания в кэш
+            maxsize: Максимальное количество хранимых записей
+        """
+        self.threshold = threshold
+        self.maxsize = maxsize
+        # Кольцевой буфер: матрица выделяется один раз, новые записи перезаписывают самые старые
+        self._matrix: Optional[np.ndarray] = None
+        self._values: List[Any] = [None] * maxsize
+        self._size = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, embedding) -> Optional[Any]:
+        """Поиск значения для ближайшего сохраненного эмбеддинга"""
+        query = self._normalize(embedding)
+        with self._lock:
+            if self._size == 0:
+                return None
+            scores = self._matrix[:self._size] @ query
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                return self._values[best]
+        return None
+
+    def put(self, embedding, value: Any) -> None:
+        """Сохранение значения; при переполнении вытесняются самые старые записи"""
+        vector = self._normalize(embedding)
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.maxsize, vector.shape[0]), dtype=np.float32)
+            self._matrix[self._next] = vector
+            self._values[self._next] = value
+            self._next = (self._next + 1) % self.maxsize
+            self._size = min(self._size + 1, self.maxsize)
+
+    def clear(self) -> None:
+        """Очистка кэша"""
+        with self._lock:
+            self._matrix = None
+            self._values = [None] * self.maxsize
+            self._size = 0
+            self._next = 0